@@ -230,6 +230,23 @@ print("\nModel saved to:")
 print("  Keras format:", keras_path)
 print("  H5 format:   ", h5_path)
 
+# Int8 TFLite export -- used by the API for fast single-sample inference
+def representative_dataset():
+    for i in np.random.choice(len(X_train), 500, replace=False):
+        yield [X_train[i:i + 1]]
+
+converter = tf.lite.TFLiteConverter.from_keras_model(model)
+converter.optimizations = [tf.lite.Optimize.DEFAULT]
+converter.representative_dataset = representative_dataset
+converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+converter.inference_input_type = tf.int8
+converter.inference_output_type = tf.int8
+
+tflite_path = os.path.join(MODEL_DIR, "quickdraw_house_cat_dog_car.tflite")
+with open(tflite_path, "wb") as f:
+    f.write(converter.convert())
+print("  TFLite int8: ", tflite_path)
+
 #Quick test prediction (optional)
 
 sample_idx = np.random.randint(0, len(X_val))
@@ -3,7 +3,7 @@ Configuration settings for the QuickDraw API.
 Modify these settings based on your deployment needs.
 """
 import os
-from typing import List
+from typing import List, Tuple
 
 
 class Settings:
@@ -18,6 +18,9 @@ class Settings:
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     RELOAD: bool = False  # Set to True for development
+    # Worker processes for `python main.py`. Each loads its own model and runs its own
+    # micro-batcher, so opt in explicitly (e.g. 2 * cores + 1 on a dedicated host)
+    WORKERS: int = int(os.getenv("WORKERS", "1"))
     
     # CORS Settings
     CORS_ORIGINS: List[str] = ["*"]  # In production, specify allowed origins
@@ -27,7 +30,13 @@ class Settings:
     
     # Model Settings
     MODEL_PATH: str = os.path.join("saved_models", "quickdraw_house_cat_dog_car.keras")
-    CLASS_NAMES: List[str] = [
+    # Threads per inference call for the ONNX Runtime / TFLite / Keras backends. One
+    # thread gives the lowest single-image latency; the workers provide the parallelism.
+    INFERENCE_THREADS: int = int(os.getenv("INFERENCE_THREADS", "1"))
+    # Longest a request waits for its micro-batched prediction (seconds)
+    PREDICT_TIMEOUT: float = float(os.getenv("PREDICT_TIMEOUT", "30"))
+    # Must match the label order used in Model-Training.py
+    CLASS_NAMES: Tuple[str, ...] = (
         # Animals (7)
         "cat", "dog", "bird", "fish", "bear", "butterfly", "spider",
         # Buildings & Structures (6)
@@ -46,7 +55,7 @@ class Settings:
         "sword", "axe", "hammer", "key", "crown",
         # Musical Instruments (2)
         "guitar", "piano"
-    ]
+    )
     
     # Prediction Settings
     DEFAULT_TOP_K: int = 3
@@ -58,7 +67,9 @@ class Settings:
     NORMALIZE: bool = True  # Normalize pixel values to [0, 1]
     
     # Logging
-    LOG_LEVEL: str = "INFO"  # DEBUG, INFO, WARNING, ERROR, CRITICAL
+    # DEBUG, INFO, WARNING, ERROR, CRITICAL
+    # DEBUG also writes a request_<id>.json log per prediction (see LOGGING_GUIDE.md)
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
 
 
 # Create a singleton instance
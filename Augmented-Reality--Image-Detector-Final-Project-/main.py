@@ -4,18 +4,23 @@ Exposes API endpoints for VR/AR applications to classify drawings.
 """
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
+import asyncio
 import logging
+import logging.handlers
 import os
-import base64
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-import json
+import orjson
 
+from config import settings
 from model import SketchClassifier
-from utils import preprocess_image_from_bytes, preprocess_image_from_base64
+from utils import preprocess_image_from_bytes, preprocess_images_from_bytes_batch, decode_base64_image
 
 # Configure comprehensive logging
 LOG_DIR = "api_logs"
@@ -23,29 +28,46 @@ IMAGES_LOG_DIR = os.path.join(LOG_DIR, "received_images")
 os.makedirs(LOG_DIR, exist_ok=True)
 os.makedirs(IMAGES_LOG_DIR, exist_ok=True)
 
-# Setup logging to both file and console
+# Setup logging to both file and console.
+# The real handlers are owned by a background QueueListener so request
+# handlers only enqueue records instead of blocking on file I/O.
+log_queue = queue.Queue(-1)
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+api_log_handler = logging.FileHandler(os.path.join(LOG_DIR, 'api.log'))
+api_log_handler.setFormatter(log_formatter)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(log_formatter)
+
+# Separate file for request details (only records from the "requests" logger)
+request_handler = logging.FileHandler(os.path.join(LOG_DIR, 'requests_detailed.log'))
+request_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+request_handler.addFilter(logging.Filter("requests"))
+
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    api_log_handler,
+    console_handler,
+    request_handler,
+    respect_handler_level=True
+)
+
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_DIR, 'api.log')),
-        logging.StreamHandler()
-    ]
+    level=settings.LOG_LEVEL,
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
-# Create separate logger for request details
+# Request details propagate to the root QueueHandler; the listener routes them
 request_logger = logging.getLogger("requests")
-request_handler = logging.FileHandler(os.path.join(LOG_DIR, 'requests_detailed.log'))
-request_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-request_logger.addHandler(request_handler)
 request_logger.setLevel(logging.INFO)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="QuickDraw Sketch Recognition API",
     description="API for recognizing hand-drawn sketches (house, cat, dog, car) for VR/AR applications",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware - adjust origins based on your VR application needs
@@ -60,6 +82,59 @@ app.add_middleware(
 # Initialize model (singleton)
 classifier = None
 
+# Per-request dumps (images, JSON logs) are queued as (path, payload) pairs
+# and written in batches by log_writer() off the event loop.
+LOG_BATCH_SIZE = 64
+LOG_FLUSH_INTERVAL = 0.1  # seconds
+log_sink = asyncio.Queue()
+log_writer_task = None
+
+
+def queue_dump(path: str, payload):
+    """Queue bytes, text or a JSON-serializable dict to be written to path"""
+    log_sink.put_nowait((path, payload))
+
+
+def _flush_batch(items: List[tuple]):
+    """Write a batch of queued dumps to disk (runs in a worker thread)"""
+    for path, payload in items:
+        if isinstance(payload, dict):
+            payload = orjson.dumps(payload, option=orjson.OPT_INDENT_2)
+        elif isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        # One-shot writes skip Python's buffered IO layer
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.warning(f"Failed to write log file {path}: {e}")
+
+
+async def log_writer():
+    """Drain log_sink, flushing up to LOG_BATCH_SIZE dumps per LOG_FLUSH_INTERVAL"""
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await log_sink.get()]
+        deadline = loop.time() + LOG_FLUSH_INTERVAL
+        while len(items) < LOG_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(log_sink.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await asyncio.to_thread(_flush_batch, items)
+        finally:
+            for _ in items:
+                log_sink.task_done()
+
 
 class PredictionRequest(BaseModel):
     """Request model for base64 encoded image"""
@@ -74,19 +149,45 @@ class PredictionResponse(BaseModel):
     message: Optional[str] = None
 
 
+class BatchPredictionResponse(BaseModel):
+    """Response model for batch predictions (one prediction list per image)"""
+    results: List[List[dict]]
+    success: bool
+    message: Optional[str] = None
+
+
 @app.on_event("startup")
 async def startup_event():
     """Load the model on startup"""
-    global classifier
+    global classifier, log_writer_task
+    log_listener.start()
+    # Bounded pool for asyncio.to_thread (decode, preprocessing, log flushes)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    )
+    log_writer_task = asyncio.create_task(log_writer())
     try:
         logger.info("Loading QuickDraw model...")
         classifier = SketchClassifier()
+        classifier.start_batching()
         logger.info("Model loaded successfully!")
     except Exception as e:
         logger.error(f"Failed to load model: {e}")
         raise
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued dumps and log records on shutdown"""
+    logger.info("Shutting down QuickDraw API...")
+    if classifier is not None:
+        classifier.stop_batching()
+    await log_sink.join()
+    if log_writer_task is not None:
+        log_writer_task.cancel()
+    log_listener.stop()
+
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -97,6 +198,7 @@ async def root():
             "/health": "Health check",
             "/predict": "Predict from uploaded image file (POST)",
             "/predict/base64": "Predict from base64 encoded image (POST)",
+            "/predict/batch": "Predict from several uploaded image files (POST)",
             "/classes": "Get list of supported classes (GET)"
         }
     }
@@ -147,39 +249,38 @@ async def predict_from_file(
     # Generate unique request ID
     request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     
-    logger.info(f"="*80)
-    logger.info(f"[FILE-REQUEST {request_id}] New file upload prediction")
-    logger.info(f"[FILE-REQUEST {request_id}] Filename: {file.filename}")
-    logger.info(f"[FILE-REQUEST {request_id}] Content-Type: {file.content_type}")
-    logger.info(f"[FILE-REQUEST {request_id}] Top K: {top_k}")
+    logger.debug("=" * 80)
+    logger.info("[FILE-REQUEST %s] New file upload prediction", request_id)
+    logger.debug("[FILE-REQUEST %s] Filename: %s", request_id, file.filename)
+    logger.debug("[FILE-REQUEST %s] Content-Type: %s", request_id, file.content_type)
+    logger.debug("[FILE-REQUEST %s] Top K: %s", request_id, top_k)
     
     try:
         # Read image bytes
         image_bytes = await file.read()
-        logger.info(f"[FILE-REQUEST {request_id}] File size: {len(image_bytes)} bytes")
+        logger.debug("[FILE-REQUEST %s] File size: %d bytes", request_id, len(image_bytes))
         
         # Save uploaded file
         uploaded_file = os.path.join(IMAGES_LOG_DIR, f"uploaded_{request_id}_{file.filename}")
-        with open(uploaded_file, 'wb') as f:
-            f.write(image_bytes)
-        logger.info(f"[FILE-REQUEST {request_id}] File saved to: {uploaded_file}")
+        queue_dump(uploaded_file, image_bytes)
+        logger.debug("[FILE-REQUEST %s] File saved to: %s", request_id, uploaded_file)
         
         # Preprocess image
-        logger.info(f"[FILE-REQUEST {request_id}] Preprocessing image...")
-        processed_image = preprocess_image_from_bytes(image_bytes)
-        logger.info(f"[FILE-REQUEST {request_id}] Preprocessed shape: {processed_image.shape}")
+        logger.debug("[FILE-REQUEST %s] Preprocessing image...", request_id)
+        processed_image = await asyncio.to_thread(preprocess_image_from_bytes, image_bytes)
+        logger.debug("[FILE-REQUEST %s] Preprocessed shape: %s", request_id, processed_image.shape)
         
         # Make prediction
-        logger.info(f"[FILE-REQUEST {request_id}] Running inference...")
-        predictions = classifier.predict(processed_image, top_k=top_k)
+        logger.debug("[FILE-REQUEST %s] Running inference...", request_id)
+        predictions = await classifier.submit(processed_image, top_k=top_k)
         
         # Log predictions
-        logger.info(f"[FILE-REQUEST {request_id}] PREDICTIONS:")
-        for i, pred in enumerate(predictions, 1):
-            logger.info(f"[FILE-REQUEST {request_id}]   {i}. {pred['class']}: {pred['confidence_percent']}")
-        
-        logger.info(f"[FILE-REQUEST {request_id}] ✓ Success")
-        logger.info(f"="*80)
+        logger.info(
+            "[FILE-REQUEST %s] PREDICTIONS: %s", request_id,
+            ", ".join(f"{pred['class']} ({pred['confidence_percent']})" for pred in predictions)
+        )
+        logger.debug("[FILE-REQUEST %s] ✓ Success", request_id)
+        logger.debug("=" * 80)
         
         return PredictionResponse(
             predictions=predictions,
@@ -189,10 +290,69 @@ async def predict_from_file(
     
     except Exception as e:
         logger.error(f"[FILE-REQUEST {request_id}] ✗ FAILED: {e}")
-        logger.info(f"="*80)
+        logger.debug("=" * 80)
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_from_files(
+    files: List[UploadFile] = File(...),
+    top_k: int = 3
+):
+    """
+    Predict drawing classes for several uploaded image files in one request.
+    
+    Args:
+        files: Image files (PNG, JPG, etc.)
+        top_k: Number of top predictions to return per image (default: 3)
+    
+    Returns:
+        BatchPredictionResponse with one list of top predictions per file
+    """
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    # Generate unique request ID
+    request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    
+    logger.debug("=" * 80)
+    logger.info("[BATCH-REQUEST %s] New batch prediction (%d files)", request_id, len(files))
+    logger.debug("[BATCH-REQUEST %s] Top K: %s", request_id, top_k)
+    
+    try:
+        images = [await file.read() for file in files]
+        
+        # Decode and resize every file, stacked into one (N, 28, 28, 1) array
+        logger.debug("[BATCH-REQUEST %s] Preprocessing images...", request_id)
+        batch = await asyncio.to_thread(preprocess_images_from_bytes_batch, images)
+        
+        # Rows go through the shared batcher, which coalesces them into one model call
+        logger.debug("[BATCH-REQUEST %s] Running inference...", request_id)
+        results = await asyncio.gather(
+            *(classifier.submit(batch[i:i + 1], top_k=top_k) for i in range(len(batch)))
+        )
+        
+        logger.info(
+            "[BATCH-REQUEST %s] PREDICTIONS: %s", request_id,
+            "; ".join(
+                f"{file.filename}: {predictions[0]['class']} ({predictions[0]['confidence_percent']})"
+                for file, predictions in zip(files, results) if predictions
+            )
+        )
+        logger.debug("[BATCH-REQUEST %s] ✓ Success", request_id)
+        logger.debug("=" * 80)
+        
+        return BatchPredictionResponse(
+            results=results,
+            success=True,
+            message=f"Prediction successful (Request ID: {request_id})"
+        )
+    
+    except Exception as e:
+        logger.error(f"[BATCH-REQUEST {request_id}] ✗ FAILED: {e}")
+        logger.debug("=" * 80)
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
 @app.post("/predict/base64", response_model=PredictionResponse)
 async def predict_from_base64(request: PredictionRequest, http_request: Request):
     """
@@ -213,70 +373,62 @@ async def predict_from_base64(request: PredictionRequest, http_request: Request)
     request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     
     # Log incoming request details
-    logger.info(f"="*80)
-    logger.info(f"[REQUEST {request_id}] New prediction request from VR")
-    logger.info(f"[REQUEST {request_id}] Client: {http_request.client.host}:{http_request.client.port}")
-    logger.info(f"[REQUEST {request_id}] User-Agent: {http_request.headers.get('user-agent', 'Unknown')}")
-    logger.info(f"[REQUEST {request_id}] Top K: {request.top_k}")
+    logger.debug("=" * 80)
+    logger.info("[REQUEST %s] New prediction request from VR", request_id)
+    logger.debug("[REQUEST %s] Client: %s:%s", request_id, http_request.client.host, http_request.client.port)
+    logger.debug("[REQUEST %s] User-Agent: %s", request_id, http_request.headers.get('user-agent', 'Unknown'))
+    logger.debug("[REQUEST %s] Top K: %s", request_id, request.top_k)
     
     # Log base64 image details
     base64_length = len(request.image_base64)
-    logger.info(f"[REQUEST {request_id}] Base64 image length: {base64_length} characters")
-    logger.info(f"[REQUEST {request_id}] Base64 prefix (first 100 chars): {request.image_base64[:100]}...")
-    
-    # Save base64 string to file for debugging
-    base64_log_file = os.path.join(LOG_DIR, f"request_{request_id}_base64.txt")
-    with open(base64_log_file, 'w') as f:
-        f.write(request.image_base64)
-    logger.info(f"[REQUEST {request_id}] Base64 saved to: {base64_log_file}")
+    logger.debug("[REQUEST %s] Base64 image length: %d characters", request_id, base64_length)
+    logger.debug("[REQUEST %s] Base64 prefix (first 100 chars): %.100s...", request_id, request.image_base64)
     
     try:
-        # Decode and save the actual image
-        try:
-            image_data = base64.b64decode(request.image_base64)
-            image_file = os.path.join(IMAGES_LOG_DIR, f"request_{request_id}.png")
-            with open(image_file, 'wb') as f:
-                f.write(image_data)
-            logger.info(f"[REQUEST {request_id}] Decoded image saved to: {image_file}")
-            logger.info(f"[REQUEST {request_id}] Decoded image size: {len(image_data)} bytes")
-        except Exception as decode_error:
-            logger.warning(f"[REQUEST {request_id}] Failed to decode/save image: {decode_error}")
+        # Decode once; the same bytes are saved for inspection and preprocessed
+        image_data = await asyncio.to_thread(decode_base64_image, request.image_base64)
+        logger.debug("[REQUEST %s] Decoded image size: %d bytes", request_id, len(image_data))
+        
+        image_file = os.path.join(IMAGES_LOG_DIR, f"request_{request_id}.png")
+        queue_dump(image_file, image_data)
+        logger.debug("[REQUEST %s] Decoded image saved to: %s", request_id, image_file)
         
-        # Preprocess image from base64
-        logger.info(f"[REQUEST {request_id}] Preprocessing image...")
-        processed_image = preprocess_image_from_base64(request.image_base64)
-        logger.info(f"[REQUEST {request_id}] Preprocessed image shape: {processed_image.shape}")
+        # Preprocess decoded image
+        logger.debug("[REQUEST %s] Preprocessing image...", request_id)
+        processed_image = await asyncio.to_thread(preprocess_image_from_bytes, image_data)
+        logger.debug("[REQUEST %s] Preprocessed image shape: %s", request_id, processed_image.shape)
         
         # Make prediction
-        logger.info(f"[REQUEST {request_id}] Running model inference...")
-        predictions = classifier.predict(processed_image, top_k=request.top_k)
+        logger.debug("[REQUEST %s] Running model inference...", request_id)
+        predictions = await classifier.submit(processed_image, top_k=request.top_k)
         
         # Log predictions
-        logger.info(f"[REQUEST {request_id}] PREDICTIONS:")
-        for i, pred in enumerate(predictions, 1):
-            logger.info(f"[REQUEST {request_id}]   {i}. {pred['class']}: {pred['confidence_percent']} (confidence: {pred['confidence']:.4f})")
-        
-        # Save detailed request log as JSON
-        request_log = {
-            "request_id": request_id,
-            "timestamp": datetime.now().isoformat(),
-            "client_ip": http_request.client.host,
-            "client_port": http_request.client.port,
-            "user_agent": http_request.headers.get('user-agent', 'Unknown'),
-            "base64_length": base64_length,
-            "image_file": image_file if 'image_file' in locals() else None,
-            "top_k": request.top_k,
-            "predictions": predictions,
-            "success": True
-        }
+        logger.info(
+            "[REQUEST %s] PREDICTIONS: %s", request_id,
+            ", ".join(f"{pred['class']} ({pred['confidence_percent']})" for pred in predictions)
+        )
         
-        json_log_file = os.path.join(LOG_DIR, f"request_{request_id}.json")
-        with open(json_log_file, 'w') as f:
-            json.dump(request_log, f, indent=2)
-        logger.info(f"[REQUEST {request_id}] Full request log saved to: {json_log_file}")
+        # Save detailed request log as JSON (debug aid, skipped in production)
+        if logger.isEnabledFor(logging.DEBUG):
+            request_log = {
+                "request_id": request_id,
+                "timestamp": datetime.now().isoformat(),
+                "client_ip": http_request.client.host,
+                "client_port": http_request.client.port,
+                "user_agent": http_request.headers.get('user-agent', 'Unknown'),
+                "base64_length": base64_length,
+                "image_file": image_file,
+                "top_k": request.top_k,
+                "predictions": predictions,
+                "success": True
+            }
+            
+            json_log_file = os.path.join(LOG_DIR, f"request_{request_id}.json")
+            queue_dump(json_log_file, request_log)
+            logger.debug("[REQUEST %s] Full request log saved to: %s", request_id, json_log_file)
         
-        logger.info(f"[REQUEST {request_id}] ✓ Prediction completed successfully")
-        logger.info(f"="*80)
+        logger.debug("[REQUEST %s] ✓ Prediction completed successfully", request_id)
+        logger.debug("=" * 80)
         
         return PredictionResponse(
             predictions=predictions,
@@ -288,7 +440,7 @@ async def predict_from_base64(request: PredictionRequest, http_request: Request)
         logger.error(f"[REQUEST {request_id}] ✗ Prediction FAILED")
         logger.error(f"[REQUEST {request_id}] Error: {str(e)}")
         logger.error(f"[REQUEST {request_id}] Error type: {type(e).__name__}")
-        logger.info(f"="*80)
+        logger.debug("=" * 80)
         
         # Save error log
         error_log = {
@@ -300,18 +452,21 @@ async def predict_from_base64(request: PredictionRequest, http_request: Request)
             "success": False
         }
         error_log_file = os.path.join(LOG_DIR, f"request_{request_id}_ERROR.json")
-        with open(error_log_file, 'w') as f:
-            json.dump(error_log, f, indent=2)
+        queue_dump(error_log_file, error_log)
         
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
 if __name__ == "__main__":
-    # Run the API server
+    # Run the API server. Each worker process runs startup_event and loads its
+    # own classifier; use `uvicorn main:app --reload` for development instead.
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
+        host=settings.HOST,
+        port=settings.PORT,
+        workers=settings.WORKERS,
+        # "auto" picks uvloop/httptools when installed (uvicorn[standard] skips uvloop on Windows)
+        loop="auto",
+        http="auto",
         log_level="info"
     )
@@ -3,17 +3,39 @@ Model inference module for QuickDraw sketch classification.
 Handles model loading and prediction logic.
 """
 import os
+import asyncio
 import numpy as np
 import tensorflow as tf
-from typing import List, Dict
+from typing import List, Dict, NamedTuple
 import logging
 
+from config import settings
+
+try:
+    import onnxruntime as ort
+except ImportError:  # ONNX Runtime is optional; fall back to TensorFlow
+    ort = None
+
 logger = logging.getLogger(__name__)
 
+# "0.00%" ... "100.00%" indexed by confidence in basis points (confidence * 10000)
+_PCT_LUT = tuple(f"{i / 100:.2f}%" for i in range(10001))
+
+
+class PendingPrediction(NamedTuple):
+    """A preprocessed image waiting in the micro-batching queue"""
+    image: np.ndarray
+    top_k: int
+    future: asyncio.Future
+
 
 class SketchClassifier:
     """QuickDraw sketch classifier"""
     
+    # Micro-batching settings used by submit()
+    MAX_BATCH_SIZE = 32
+    BATCH_WINDOW = 0.005  # seconds
+    
     def __init__(self, model_path: str = None):
         """
         Initialize the classifier with a trained model.
@@ -21,30 +43,36 @@ class SketchClassifier:
         Args:
             model_path: Path to the trained model file. If None, uses default path.
         """
-        # Extended class list matching Model-Training.py
-        self.class_names = [
-            # Animals
-            "cat", "dog", "bird", "fish", "bear", "butterfly", "bee", "spider",
-            # Buildings & Structures
-            "house", "castle", "barn", "bridge", "lighthouse", "church",
-            # Transportation
-            "car", "airplane", "bicycle", "boat", "train", "truck", "bus",
-            # Nature
-            "tree", "flower", "sun", "moon", "cloud", "mountain", "river",
-            # Common Objects
-            "apple", "banana", "book", "chair", "table", "cup", "umbrella",
-            # People & Body
-            "face", "eye", "hand", "foot",
-            # Shapes & Symbols
-            "circle", "triangle", "square", "star", "heart",
-            # Tools & Items
-            "sword", "axe", "hammer", "key", "crown"
-        ]
+        # Label order comes from config so it matches the trained model
+        self.class_names = settings.CLASS_NAMES
+        # Cached array so top-k class names can be gathered in one indexing op
+        self._class_arr = np.asarray(self.class_names)
         
         # Default model path
         if model_path is None:
             model_path = os.path.join("saved_models", "quickdraw_house_cat_dog_car.keras")
         
+        # Prefer the int8 TFLite export, then ONNX Runtime, when they sit next
+        # to the Keras model; the Keras model is the fallback
+        self.model = None
+        self.interpreter = None
+        self.session = None
+        tflite_path = model_path.replace(".keras", ".tflite")
+        onnx_path = model_path.replace(".keras", ".onnx")
+        if os.path.exists(tflite_path):
+            self._load_tflite(tflite_path)
+        elif ort is not None and os.path.exists(onnx_path):
+            self._load_onnx(onnx_path)
+        else:
+            self._load_keras(model_path)
+        
+        logger.info(f"Model input shape: {self.input_shape}")
+        
+        # Warm up so graph construction doesn't land on the first request
+        self._infer(np.zeros((1, *self.input_shape), dtype=np.float32))
+    
+    def _load_keras(self, model_path: str):
+        """Load the Keras model (fallback when no TFLite export exists)"""
         # Check if model exists
         if not os.path.exists(model_path):
             # Try .h5 format as fallback
@@ -59,12 +87,109 @@ class SketchClassifier:
                 )
         
         logger.info(f"Loading model from: {model_path}")
+        # Match the TFLite/ONNX backends instead of TF's default one-thread-per-core pool,
+        # which oversubscribes the CPU once several workers run (must precede TF's first op)
+        tf.config.threading.set_intra_op_parallelism_threads(settings.INFERENCE_THREADS)
         self.model = tf.keras.models.load_model(model_path)
         logger.info("Model loaded successfully!")
         
         # Verify input shape
         self.input_shape = self.model.input_shape[1:]  # (28, 28, 1)
-        logger.info(f"Model input shape: {self.input_shape}")
+        
+        # Fixed-signature graph; model.predict() has heavy per-call overhead for small batches
+        self._keras_fn = tf.function(
+            lambda x: self.model(x, training=False),
+            input_signature=[tf.TensorSpec((None, 28, 28, 1), tf.float32)]
+        )
+    
+    def _load_tflite(self, tflite_path: str):
+        """Load the int8 quantized TFLite model"""
+        logger.info(f"Loading TFLite model from: {tflite_path}")
+        # The default XNNPACK delegate runs on num_threads CPU threads
+        self.interpreter = tf.lite.Interpreter(
+            model_path=tflite_path, num_threads=settings.INFERENCE_THREADS
+        )
+        self.interpreter.allocate_tensors()
+        self._tflite_input = self.interpreter.get_input_details()[0]
+        self._tflite_output = self.interpreter.get_output_details()[0]
+        # One allocated interpreter per padded batch size (see _tflite_interpreter)
+        self._tflite_path = tflite_path
+        self._tflite_interpreters = {int(self._tflite_input["shape"][0]): self.interpreter}
+        logger.info("TFLite model loaded successfully!")
+        
+        self.input_shape = tuple(int(d) for d in self._tflite_input["shape"][1:])
+    
+    def _load_onnx(self, onnx_path: str):
+        """Load the ONNX export with ONNX Runtime on the CPU execution provider"""
+        logger.info(f"Loading ONNX model from: {onnx_path}")
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = settings.INFERENCE_THREADS
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            onnx_path, sess_options=session_options, providers=["CPUExecutionProvider"]
+        )
+        onnx_input = self.session.get_inputs()[0]
+        self._onnx_input = onnx_input.name
+        logger.info("ONNX model loaded successfully!")
+        
+        self.input_shape = tuple(onnx_input.shape[1:])
+    
+    def _tflite_interpreter(self, batch_size: int) -> "tf.lite.Interpreter":
+        """
+        Return an interpreter allocated for batch_size, creating it on first use.
+        
+        Resizing one shared interpreter would reallocate its tensors whenever the
+        micro-batch size changes, so each padded size keeps its own.
+        """
+        interpreter = self._tflite_interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = tf.lite.Interpreter(
+                model_path=self._tflite_path, num_threads=settings.INFERENCE_THREADS
+            )
+            interpreter.resize_tensor_input(self._tflite_input["index"], (batch_size, *self.input_shape))
+            interpreter.allocate_tensors()
+            self._tflite_interpreters[batch_size] = interpreter
+        return interpreter
+    
+    def _infer(self, images: np.ndarray) -> np.ndarray:
+        """
+        Run the loaded model on a batch of preprocessed images.
+        
+        Args:
+            images: Preprocessed images of shape (N, 28, 28, 1)
+        
+        Returns:
+            Class probabilities of shape (N, num_classes)
+        """
+        if self.session is not None:
+            return self.session.run(None, {self._onnx_input: images.astype(np.float32, copy=False)})[0]
+        if self.interpreter is None:
+            return self._keras_fn(images.astype(np.float32, copy=False)).numpy()
+        
+        # Pad to the next power of two so only a handful of batch shapes are ever allocated
+        count = images.shape[0]
+        batch_size = 1 << (count - 1).bit_length()
+        if batch_size > count:
+            padding = np.zeros((batch_size - count, *images.shape[1:]), dtype=images.dtype)
+            images = np.concatenate([images, padding])
+        interpreter = self._tflite_interpreter(batch_size)
+        input_index = self._tflite_input["index"]
+        
+        # Quantize [0, 1] floats into the interpreter's input dtype
+        input_dtype = self._tflite_input["dtype"]
+        scale, zero_point = self._tflite_input["quantization"]
+        if scale:
+            info = np.iinfo(input_dtype)
+            images = np.clip(np.round(images / scale + zero_point), info.min, info.max)
+        interpreter.set_tensor(input_index, images.astype(input_dtype))
+        interpreter.invoke()
+        
+        # Dequantize the output back to probabilities (dropping the padded rows)
+        output = interpreter.get_tensor(self._tflite_output["index"])[:count]
+        scale, zero_point = self._tflite_output["quantization"]
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
     
     def predict(self, image: np.ndarray, top_k: int = 3) -> List[Dict[str, any]]:
         """
@@ -77,28 +202,118 @@ class SketchClassifier:
         Returns:
             List of dictionaries containing class names and confidence scores
         """
-        # Validate input shape
+        self._check_input_shape(image)
+        
+        # Make prediction
+        predictions = self._infer(image)
+        return self._build_results(predictions, self._top_k_indices(predictions, top_k))[0]
+    
+    async def submit(self, image: np.ndarray, top_k: int = 3) -> List[Dict[str, any]]:
+        """
+        Queue a preprocessed image for micro-batched inference.
+        Concurrent requests are stacked into a single model call by the
+        background batcher started with start_batching().
+        
+        Args:
+            image: Preprocessed image array of shape (1, 28, 28, 1)
+            top_k: Number of top predictions to return
+        
+        Returns:
+            List of dictionaries containing class names and confidence scores
+        
+        Raises:
+            TimeoutError: If no result arrives within settings.PREDICT_TIMEOUT
+        """
+        self._check_input_shape(image)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.put_nowait(PendingPrediction(image, top_k, future))
+        try:
+            # Bounded so a stalled batcher fails requests instead of hanging them
+            return await asyncio.wait_for(future, settings.PREDICT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Prediction timed out after {settings.PREDICT_TIMEOUT}s") from None
+    
+    def start_batching(self):
+        """Start the background micro-batching task (must run inside the event loop)"""
+        self._pending = asyncio.Queue()
+        self._batcher_task = asyncio.create_task(self._batcher())
+    
+    def stop_batching(self):
+        """Cancel the background micro-batching task"""
+        self._batcher_task.cancel()
+    
+    async def _batcher(self):
+        """Collect up to MAX_BATCH_SIZE queued images per BATCH_WINDOW and run them together"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._pending.get()]
+            deadline = loop.time() + self.BATCH_WINDOW
+            while len(items) < self.MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._pending.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Any failure (inference or result building) goes to this batch's requests;
+            # letting it escape would kill the batcher and stall every later request
+            try:
+                images = np.concatenate([item.image for item in items])
+                predictions = await asyncio.to_thread(self._infer, images)
+                
+                # The top k rows are sorted, so each request takes a prefix of the largest k
+                max_k = max(item.top_k for item in items)
+                results = self._build_results(predictions, self._top_k_indices(predictions, max_k))
+            except Exception as e:
+                logger.error(f"Batched inference failed: {e}")
+                for item in items:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+            
+            for item, image_results in zip(items, results):
+                # Skip requests that were cancelled (e.g. client disconnected)
+                if not item.future.done():
+                    item.future.set_result(image_results[:max(item.top_k, 0)])
+    
+    def _check_input_shape(self, image: np.ndarray):
+        """Validate that image is a single preprocessed sample"""
         if image.shape != (1, 28, 28, 1):
             raise ValueError(
                 f"Expected input shape (1, 28, 28, 1), got {image.shape}. "
                 "Please preprocess the image first."
             )
+    
+    def _top_k_indices(self, predictions: np.ndarray, top_k: int) -> np.ndarray:
+        """Indices of the top k classes for each row, sorted by descending confidence"""
+        # O(N) partial selection per row, then sort only the k selected items
+        k = max(0, min(top_k, predictions.shape[1]))
+        k_indices = np.argpartition(-predictions, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(predictions, k_indices, axis=1), axis=1)
+        return np.take_along_axis(k_indices, order, axis=1)
+    
+    def _build_results(self, predictions: np.ndarray, top_indices: np.ndarray) -> List[List[Dict[str, any]]]:
+        """Build prediction dicts for each row of predictions from its top indices"""
+        # Convert both gathers with one tolist() each instead of boxing per element
+        classes = self._class_arr[top_indices].tolist()
+        # Round in float64 so the serialized floats stay short (0.9991, not 0.9991400241851807)
+        confidences = np.round(
+            np.take_along_axis(predictions, top_indices, axis=1).astype(np.float64), 4
+        ).tolist()
         
-        # Make prediction
-        predictions = self.model.predict(image, verbose=0)
-        
-        # Get top k predictions
-        top_indices = np.argsort(predictions[0])[::-1][:top_k]
-        
-        results = []
-        for idx in top_indices:
-            results.append({
-                "class": self.class_names[idx],
-                "confidence": float(predictions[0][idx]),
-                "confidence_percent": f"{predictions[0][idx] * 100:.2f}%"
-            })
-        
-        return results
+        return [
+            [
+                {
+                    "class": class_name,
+                    "confidence": confidence,
+                    "confidence_percent": _PCT_LUT[min(int(confidence * 10000 + 0.5), 10000)]
+                }
+                for class_name, confidence in zip(image_classes, image_confidences)
+            ]
+            for image_classes, image_confidences in zip(classes, confidences)
+        ]
     
     def predict_batch(self, images: np.ndarray, top_k: int = 3) -> List[List[Dict[str, any]]]:
         """
@@ -112,21 +327,5 @@ class SketchClassifier:
             List of prediction results for each image
         """
         # Make predictions
-        predictions = self.model.predict(images, verbose=0)
-        
-        results = []
-        for pred in predictions:
-            # Get top k predictions for this image
-            top_indices = np.argsort(pred)[::-1][:top_k]
-            
-            image_results = []
-            for idx in top_indices:
-                image_results.append({
-                    "class": self.class_names[idx],
-                    "confidence": float(pred[idx]),
-                    "confidence_percent": f"{pred[idx] * 100:.2f}%"
-                })
-            
-            results.append(image_results)
-        
-        return results
+        predictions = self._infer(images)
+        return self._build_results(predictions, self._top_k_indices(predictions, top_k))
@@ -2,11 +2,19 @@
 """
 Upload QuickDraw model to Hugging Face Hub.
 Requires: pip install huggingface_hub
+Optional: pip install hf_transfer (Rust-backed parallel LFS uploads)
 """
+import importlib.util
 import os
 from pathlib import Path
-from huggingface_hub import HfApi, create_repo, upload_file, upload_folder
-import json
+
+# Must be set before huggingface_hub is imported; files are always passed by
+# path so the hub hashes and uploads them in chunks straight from disk
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
+from huggingface_hub import HfApi, CommitOperationAdd, create_repo
+import orjson
 
 # Configuration
 REPO_NAME = "quickdraw-sketch-recognition"  # Change this to your preferred name
@@ -120,13 +128,20 @@ from PIL import Image
 # Load model
 model = tf.keras.models.load_model('quickdraw_house_cat_dog_car.keras')
 
+# Wrap the model once in a fixed-signature graph. Calling it directly skips
+# the per-call overhead of model.predict(), which dominates for single images.
+predict_fn = tf.function(
+    lambda x: model(x, training=False),
+    input_signature=[tf.TensorSpec([None, 28, 28, 1], tf.float32)]
+)
+
 # Prepare image (28x28 grayscale)
 img = Image.open('drawing.png').convert('L').resize((28, 28))
-img_array = np.array(img) / 255.0
+img_array = np.array(img, dtype=np.float32) / 255.0
 img_array = img_array.reshape(1, 28, 28, 1)
 
 # Predict
-predictions = model.predict(img_array)
+predictions = predict_fn(tf.constant(img_array)).numpy()
 class_names = ['cat', 'dog', 'bird', ...]  # Full list in model files
 
 top_3 = np.argsort(predictions[0])[-3:][::-1]
@@ -134,6 +149,22 @@ for idx in top_3:
     print(f"{class_names[idx]}: {predictions[0][idx]*100:.2f}%")
 ```
 
+### ONNX Runtime (CPU)
+
+```python
+import onnxruntime as ort
+
+so = ort.SessionOptions()
+so.intra_op_num_threads = 1  # lowest single-image latency
+so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+session = ort.InferenceSession('quickdraw_house_cat_dog_car.onnx', sess_options=so,
+                               providers=['CPUExecutionProvider'])
+
+predictions = session.run(None, {'input': img_array.astype(np.float32)})[0]
+```
+
+For mobile and standalone VR headsets, use the int8 `.tflite` file; TFLite runs it on its default XNNPACK CPU kernels.
+
 ### FastAPI Server
 
 A complete FastAPI server is available in the repository for production deployment:
@@ -190,11 +221,12 @@ public class QuickDrawAPI : MonoBehaviour
 
 ## Model Files
 
-This repository contains three formats:
+This repository contains four formats:
 
 1. **quickdraw_house_cat_dog_car.keras** - Native Keras format (recommended)
 2. **quickdraw_house_cat_dog_car.h5** - Legacy HDF5 format
 3. **quickdraw_house_cat_dog_car.onnx** - ONNX format for cross-platform inference
+4. **quickdraw_house_cat_dog_car.tflite** - Int8 quantized TFLite format for low-latency CPU inference
 
 ## Performance
 
@@ -291,39 +323,31 @@ def upload_to_hf(username=None, repo_name=REPO_NAME, token=None):
         )
         print(f"✓ Repository created/verified: https://huggingface.co/{repo_id}")
         
-        # Upload README
-        print("\nUploading model card...")
-        upload_file(
-            path_or_fileobj=README_PATH,
-            path_in_repo="README.md",
-            repo_id=repo_id,
-            token=token
-        )
-        print("✓ Model card uploaded")
+        # Collect every file into one commit so the LFS uploads run concurrently
+        operations = [
+            CommitOperationAdd(path_in_repo="README.md", path_or_fileobj=README_PATH)
+        ]
         
-        # Upload model files
-        print("\nUploading model files...")
+        # Model files
+        print("\nPreparing model files...")
         model_files = [
             "quickdraw_house_cat_dog_car.keras",
             "quickdraw_house_cat_dog_car.h5",
-            "quickdraw_house_cat_dog_car.onnx"
+            "quickdraw_house_cat_dog_car.onnx",
+            "quickdraw_house_cat_dog_car.tflite"
         ]
         
         for model_file in model_files:
             file_path = os.path.join(MODEL_DIR, model_file)
             if os.path.exists(file_path):
-                print(f"  Uploading {model_file}...")
-                upload_file(
-                    path_or_fileobj=file_path,
-                    path_in_repo=model_file,
-                    repo_id=repo_id,
-                    token=token
+                operations.append(
+                    CommitOperationAdd(path_in_repo=model_file, path_or_fileobj=file_path)
                 )
-                print(f"  ✓ {model_file} uploaded")
+                print(f"  ✓ {model_file}")
             else:
                 print(f"  ⚠ {model_file} not found, skipping")
         
-        # Create and upload config
+        # Create config
         config = {
             "model_type": "cnn",
             "framework": "tensorflow",
@@ -344,17 +368,20 @@ def upload_to_hf(username=None, repo_name=REPO_NAME, token=None):
         }
         
         config_path = "model_config.json"
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=2)
+        with open(config_path, 'wb') as f:
+            f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+        operations.append(
+            CommitOperationAdd(path_in_repo="config.json", path_or_fileobj=config_path)
+        )
         
-        print("\nUploading model config...")
-        upload_file(
-            path_or_fileobj=config_path,
-            path_in_repo="config.json",
+        print(f"\nUploading {len(operations)} files in a single commit...")
+        api.create_commit(
             repo_id=repo_id,
+            operations=operations,
+            commit_message="Upload QuickDraw sketch recognition model",
             token=token
         )
-        print("✓ Config uploaded")
+        print("✓ Model card, model files and config uploaded")
         
         print(f"\n{'='*80}")
         print(f"✓ SUCCESS! Model uploaded to Hugging Face")
@@ -1,15 +1,30 @@
 """
 Utility functions for image preprocessing.
-Handles various input formats: bytes, base64, PIL images, etc.
+Handles various input formats: bytes, numpy arrays, stroke data, etc.
+Base64 payloads are decoded once with decode_base64_image and then
+preprocessed from bytes.
 """
 import io
-import base64
 import numpy as np
-from PIL import Image
+import pybase64
+from PIL import Image, ImageDraw
 import logging
+from typing import List
 
 logger = logging.getLogger(__name__)
 
+# Largest encoded image accepted from clients (guards decode/Image.open against huge payloads)
+MAX_IMAGE_BYTES = 8 * 1024 * 1024
+
+# Sources at least this large are downsampled with BOX instead of BILINEAR
+BOX_RESAMPLE_MIN_SIZE = 224
+
+# ITU-R BT.601 luma weights for RGB to grayscale conversion
+_RGB2Y = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Maps 8-bit grayscale pixel values to [0, 1] floats via Image.point
+_NORMALIZE_LUT = [i / 255.0 for i in range(256)]
+
 
 def preprocess_image_from_bytes(image_bytes: bytes) -> np.ndarray:
     """
@@ -21,21 +36,27 @@ def preprocess_image_from_bytes(image_bytes: bytes) -> np.ndarray:
     Returns:
         Preprocessed numpy array of shape (1, 28, 28, 1) normalized to [0, 1]
     """
+    if len(image_bytes) > MAX_IMAGE_BYTES:
+        raise ValueError(f"Image too large (limit: {MAX_IMAGE_BYTES // (1024 * 1024)} MB)")
+    
     try:
         # Load image from bytes
         image = Image.open(io.BytesIO(image_bytes))
         
+        # JPEG only (no-op otherwise): let libjpeg decode straight to grayscale at the
+        # smallest DCT scale (1/2 to 1/8) that is still at least 28x28
+        image.draft('L', (28, 28))
+        
         # Convert to grayscale
         image = image.convert('L')
         
         # Resize to 28x28
-        image = image.resize((28, 28), Image.Resampling.LANCZOS)
-        
-        # Convert to numpy array
-        image_array = np.array(image, dtype=np.float32)
+        image = image.resize((28, 28), _resample_filter(image.size))
         
-        # Normalize to [0, 1]
-        image_array = image_array / 255.0
+        # Normalize to [0, 1] with a lookup table inside PIL, yielding a float32 image,
+        # and view its raw buffer directly (skips the __array_interface__ path)
+        image = image.point(_NORMALIZE_LUT, 'F')
+        image_array = np.frombuffer(image.tobytes(), dtype=np.float32)
         
         # Reshape to (1, 28, 28, 1) for model input
         image_array = image_array.reshape(1, 28, 28, 1)
@@ -47,30 +68,43 @@ def preprocess_image_from_bytes(image_bytes: bytes) -> np.ndarray:
         raise ValueError(f"Failed to process image: {str(e)}")
 
 
-def preprocess_image_from_base64(base64_string: str) -> np.ndarray:
+def preprocess_images_from_bytes_batch(images: List[bytes]) -> np.ndarray:
     """
-    Preprocess image from base64 encoded string.
+    Preprocess several images from raw bytes into one stacked batch.
+    
+    Args:
+        images: List of raw image bytes (PNG, JPG, etc.)
+    
+    Returns:
+        Preprocessed numpy array of shape (N, 28, 28, 1) normalized to [0, 1]
+    """
+    batch = np.empty((len(images), 28, 28, 1), dtype=np.float32)
+    for i, image_bytes in enumerate(images):
+        batch[i] = preprocess_image_from_bytes(image_bytes)[0]
+    return batch
+
+def decode_base64_image(base64_string: str) -> bytes:
+    """
+    Decode a base64 encoded image using the SIMD-accelerated pybase64 decoder.
     
     Args:
         base64_string: Base64 encoded image string (with or without data URI prefix)
     
     Returns:
-        Preprocessed numpy array of shape (1, 28, 28, 1) normalized to [0, 1]
+        Raw image bytes
+    
+    Raises:
+        ValueError: If the decoded image would exceed MAX_IMAGE_BYTES
     """
-    try:
-        # Remove data URI prefix if present (e.g., "data:image/png;base64,")
-        if ',' in base64_string and base64_string.startswith('data:'):
-            base64_string = base64_string.split(',', 1)[1]
-        
-        # Decode base64 to bytes
-        image_bytes = base64.b64decode(base64_string)
-        
-        # Use the bytes preprocessing function
-        return preprocess_image_from_bytes(image_bytes)
+    # Remove data URI prefix if present (e.g., "data:image/png;base64,")
+    if base64_string.startswith('data:'):
+        _, _, base64_string = base64_string.partition(',')
     
-    except Exception as e:
-        logger.error(f"Error preprocessing image from base64: {e}")
-        raise ValueError(f"Failed to process base64 image: {str(e)}")
+    # Reject oversized payloads before spending time decoding them
+    if len(base64_string) // 4 * 3 > MAX_IMAGE_BYTES:
+        raise ValueError(f"Image too large (limit: {MAX_IMAGE_BYTES // (1024 * 1024)} MB)")
+    
+    return pybase64.b64decode(base64_string, validate=False)
 
 
 def preprocess_image_from_array(image_array: np.ndarray) -> np.ndarray:
@@ -96,10 +130,8 @@ def preprocess_image_from_array(image_array: np.ndarray) -> np.ndarray:
         if len(image_array.shape) == 3:  # (height, width, channels)
             # If RGB, convert to grayscale
             if image_array.shape[2] == 3:
-                # Simple RGB to grayscale conversion
-                image_array = 0.299 * image_array[:, :, 0] + \
-                             0.587 * image_array[:, :, 1] + \
-                             0.114 * image_array[:, :, 2]
+                # RGB to grayscale as a single matrix-vector product
+                image_array = image_array @ _RGB2Y
             elif image_array.shape[2] == 1:
                 image_array = image_array.squeeze(-1)
         
@@ -107,15 +139,15 @@ def preprocess_image_from_array(image_array: np.ndarray) -> np.ndarray:
         if len(image_array.shape) != 2:
             raise ValueError(f"Cannot process image with shape {image_array.shape}")
         
-        # Resize if needed
+        # Resize if needed, staying in float32 ('F' mode) to avoid uint8 quantization
         if image_array.shape != (28, 28):
-            image_pil = Image.fromarray(image_array.astype(np.uint8))
-            image_pil = image_pil.resize((28, 28), Image.Resampling.LANCZOS)
-            image_array = np.array(image_pil, dtype=np.float32)
+            image_pil = Image.fromarray(np.ascontiguousarray(image_array))
+            image_pil = image_pil.resize((28, 28), _resample_filter(image_pil.size))
+            image_array = np.asarray(image_pil, dtype=np.float32).copy()
         
         # Normalize to [0, 1] if not already
         if image_array.max() > 1.0:
-            image_array = image_array / 255.0
+            np.multiply(image_array, np.float32(1 / 255.0), out=image_array)
         
         # Reshape to (1, 28, 28, 1)
         image_array = image_array.reshape(1, 28, 28, 1)
@@ -142,31 +174,20 @@ def preprocess_stroke_data(strokes: list, canvas_size: int = 256) -> np.ndarray:
     """
     try:
         # Create a blank canvas
-        canvas = np.zeros((canvas_size, canvas_size), dtype=np.uint8)
+        image = Image.new('L', (canvas_size, canvas_size), 0)
+        draw = ImageDraw.Draw(image)
         
-        # Draw strokes on canvas
+        # Draw strokes on canvas, one C-level line call per stroke
         for stroke in strokes:
             if len(stroke) < 2:
                 continue
-            
-            # Draw lines between consecutive points
-            for i in range(len(stroke) - 1):
-                x1, y1 = stroke[i]
-                x2, y2 = stroke[i + 1]
-                
-                # Simple line drawing (Bresenham's algorithm would be better)
-                # For now, use a simple approximation
-                points = _interpolate_points(x1, y1, x2, y2)
-                for x, y in points:
-                    if 0 <= x < canvas_size and 0 <= y < canvas_size:
-                        canvas[int(y), int(x)] = 255
-        
-        # Convert canvas to PIL Image for resizing
-        image = Image.fromarray(canvas)
-        image = image.resize((28, 28), Image.Resampling.LANCZOS)
-        
-        # Convert to numpy array and normalize
-        image_array = np.array(image, dtype=np.float32) / 255.0
+            draw.line([tuple(point) for point in stroke], fill=255, width=2, joint='curve')
+        
+        # Resize the canvas down to model input size
+        image = image.resize((28, 28), _resample_filter(image.size))
+        
+        # Normalize to [0, 1] with a lookup table inside PIL
+        image_array = np.frombuffer(image.point(_NORMALIZE_LUT, 'F').tobytes(), dtype=np.float32)
         
         # Reshape to (1, 28, 28, 1)
         image_array = image_array.reshape(1, 28, 28, 1)
@@ -178,22 +199,20 @@ def preprocess_stroke_data(strokes: list, canvas_size: int = 256) -> np.ndarray:
         raise ValueError(f"Failed to process stroke data: {str(e)}")
 
 
-def _interpolate_points(x1: float, y1: float, x2: float, y2: float, num_points: int = 10) -> list:
+
+def _resample_filter(size: tuple) -> Image.Resampling:
     """
-    Interpolate points between two coordinates for smooth line drawing.
+    Pick the resampling filter for downsizing an image of the given size to 28x28.
+    
+    BOX anti-aliases correctly and is cheapest for large downscales; BILINEAR
+    is used for smaller sources. LANCZOS buys nothing at a 28x28 target.
     
     Args:
-        x1, y1: Start coordinates
-        x2, y2: End coordinates
-        num_points: Number of points to interpolate
+        size: (width, height) of the source image
     
     Returns:
-        List of (x, y) coordinate tuples
+        PIL resampling filter
     """
-    points = []
-    for i in range(num_points + 1):
-        t = i / num_points
-        x = x1 + t * (x2 - x1)
-        y = y1 + t * (y2 - y1)
-        points.append((x, y))
-    return points
+    if min(size) >= BOX_RESAMPLE_MIN_SIZE:
+        return Image.Resampling.BOX
+    return Image.Resampling.BILINEAR
@@ -4,32 +4,43 @@ Helper script to view and analyze API request logs.
 Useful for debugging VR drawing submissions and understanding what's being sent.
 """
 import os
-import json
-import base64
-from pathlib import Path
-from PIL import Image
-import io
-from datetime import datetime
+from collections import Counter
+import orjson
+
+# PIL, io, base64 and datetime are imported inside the commands that use them
+# so `list`/`stats` and the usage text start quickly
 
 LOG_DIR = "api_logs"
 IMAGES_DIR = os.path.join(LOG_DIR, "received_images")
 
 
+def _request_log_paths():
+    """Paths of all successful request logs (request_<id>.json, excluding _ERROR logs)."""
+    if not os.path.isdir(LOG_DIR):
+        return []
+    with os.scandir(LOG_DIR) as entries:
+        return [
+            entry.path for entry in entries
+            if entry.name.startswith("request_")
+            and entry.name.endswith(".json")
+            and not entry.name.endswith("_ERROR.json")
+        ]
+
+
 def list_recent_requests(limit=10):
     """List recent API requests with their details."""
-    json_files = sorted(
-        Path(LOG_DIR).glob("request_*.json"),
-        key=lambda x: x.stat().st_mtime,
-        reverse=True
-    )
+    from datetime import datetime
+    
+    # Request IDs are timestamps, so newest-first is a reverse name sort (no stat() calls)
+    json_files = sorted(_request_log_paths(), reverse=True)[:limit]
     
     print(f"\n{'='*80}")
     print(f"RECENT API REQUESTS (Last {limit})")
     print(f"{'='*80}\n")
     
-    for i, json_file in enumerate(json_files[:limit], 1):
-        with open(json_file, 'r') as f:
-            data = json.load(f)
+    for i, json_file in enumerate(json_files, 1):
+        with open(json_file, 'rb') as f:
+            data = orjson.loads(f.read())
         
         timestamp = datetime.fromisoformat(data['timestamp']).strftime("%Y-%m-%d %H:%M:%S")
         
@@ -55,8 +66,8 @@ def view_request(request_id):
         print(f"Error: Request {request_id} not found!")
         return
     
-    with open(json_file, 'r') as f:
-        data = json.load(f)
+    with open(json_file, 'rb') as f:
+        data = orjson.loads(f.read())
     
     print(f"\n{'='*80}")
     print(f"REQUEST DETAILS: {request_id}")
@@ -76,6 +87,8 @@ def view_request(request_id):
     if 'image_file' in data and data['image_file']:
         image_path = data['image_file']
         if os.path.exists(image_path):
+            from PIL import Image
+            
             print(f"\nImage saved at: {image_path}")
             img = Image.open(image_path)
             print(f"Image size: {img.size}")
@@ -104,6 +117,10 @@ def decode_base64_file(request_id, output_path=None):
         base64_data = f.read()
     
     try:
+        import base64
+        import io
+        from PIL import Image
+        
         image_data = base64.b64decode(base64_data)
         img = Image.open(io.BytesIO(image_data))
         
@@ -119,9 +136,14 @@ def decode_base64_file(request_id, output_path=None):
         print(f"✗ Error decoding image: {e}")
 
 
+def _read_predictions(json_file):
+    """Return the predictions list from a request log."""
+    with open(json_file, 'rb') as f:
+        return orjson.loads(f.read())['predictions']
+
 def show_statistics():
     """Show statistics about all logged requests."""
-    json_files = list(Path(LOG_DIR).glob("request_*.json"))
+    json_files = _request_log_paths()
     
     print(f"\n{'='*80}")
     print(f"API REQUEST STATISTICS")
@@ -133,18 +155,15 @@ def show_statistics():
         print("No requests logged yet.")
         return
     
-    # Count predictions by class
-    class_counts = {}
-    for json_file in json_files:
-        with open(json_file, 'r') as f:
-            data = json.load(f)
-        
-        if data['predictions']:
-            top_class = data['predictions'][0]['class']
-            class_counts[top_class] = class_counts.get(top_class, 0) + 1
+    # Count predictions by class in a single pass, without keeping parsed logs around
+    class_counts = Counter(
+        predictions[0]['class']
+        for predictions in (_read_predictions(json_file) for json_file in json_files)
+        if predictions
+    )
     
     print(f"\nTop Predictions Distribution:")
-    for class_name, count in sorted(class_counts.items(), key=lambda x: x[1], reverse=True):
+    for class_name, count in class_counts.most_common():
         print(f"  {class_name:15s}: {count:3d} ({count/len(json_files)*100:.1f}%)")
 
 
@@ -0,0 +1,50 @@
+"""
+API configuration, read from environment variables once at import time
+"""
+from typing import List, Optional
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """Validated, immutable service settings (each field maps to its upper-case env var)"""
+
+    # "model_" is a reserved pydantic namespace; model_path is a plain setting here
+    model_config = SettingsConfigDict(frozen=True, protected_namespaces=())
+
+    # Models: COCO/base weights, plus optional custom weights (enables the dual detector)
+    model_path: str = "yolov8n.pt"
+    custom_model_path: Optional[str] = None
+    confidence_threshold: float = 0.4
+    # Model input size; must match the size weights were trained and exported at
+    # (416 halves the FLOPs, but only with weights retrained at 416)
+    imgsz: int = 640
+    # Single detector mode exports .pt weights to TensorRT/OpenVINO once (opt-in: needs the
+    # runtime installed, and export_dir on a persistent volume so containers don't re-export)
+    yolo_export: bool = False
+    export_dir: Optional[str] = None
+
+    # Micro-batching: concurrent /detect requests arriving within batch_window_ms are
+    # stacked (up to max_batch images) into one detector call
+    batch_window_ms: float = 8
+    max_batch: int = 16
+    detect_timeout: float = 30  # seconds
+
+    # Dual detector only
+    cuda_graphs: bool = False
+    # Comma-separated COCO class names to keep, e.g. "person,car,chair,laptop"; empty = all 80
+    coco_classes_wanted: str = ""
+
+    @property
+    def coco_classes(self) -> List[str]:
+        """COCO_CLASSES_WANTED as a list of class names"""
+        return [name.strip() for name in self.coco_classes_wanted.split(",") if name.strip()]
+
+    @property
+    def warmup_batch_sizes(self) -> List[int]:
+        """Batch shapes the micro-batcher is likely to hit: powers of two up to max_batch, plus max_batch"""
+        sizes = {1, self.max_batch}
+        sizes.update(2 ** i for i in range(self.max_batch.bit_length()) if 2 ** i <= self.max_batch)
+        return sorted(sizes)
+
+
+settings = Settings()
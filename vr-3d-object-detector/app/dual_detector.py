@@ -2,94 +2,315 @@
 Dual YOLO Detector - Uses both COCO and custom models
 """
 import logging
-from typing import List, Dict, Any
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
+import torch
 from ultralytics import YOLO
-import base64
+from ultralytics.data.augment import LetterBox
+from ultralytics.utils import ops
+import pybase64
 from io import BytesIO
 from PIL import Image
 
+from app.detector import MAX_IMAGE_BYTES, decode_jpeg
+
 logger = logging.getLogger(__name__)
 
 
 class DualYOLODetector:
     """Detector that runs both COCO and custom models and merges results"""
     
-    def __init__(self, coco_model_path: str, custom_model_path: str, confidence: float = 0.4):
+    def __init__(self, coco_model_path: str, custom_model_path: str, confidence: float = 0.4,
+                 imgsz: int = 640, cuda_graphs: bool = False, coco_classes: Optional[Sequence[str]] = None):
         self.confidence = confidence
+        self.imgsz = imgsz
+        self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        
+        # Both models share one letterboxed input, so preprocessing runs once per image
+        self._letterbox = LetterBox(new_shape=(imgsz, imgsz), auto=False, stride=32)
+        
+        # Page-locked uint8 staging buffer (grown to the largest batch seen) for async host->device copies
+        self._host_buf = None
+        self._dev_buf = None
         
         # Load COCO model (80 classes)
+        coco_model_path = self._resolve_weights(coco_model_path)
         logger.info(f"Loading COCO model: {coco_model_path}")
-        self.coco_model = YOLO(coco_model_path)
+        self.coco_model = YOLO(coco_model_path, task="detect")
         logger.info(f"COCO model loaded with {len(self.coco_model.names)} classes")
         
         # Load custom model (5 classes)
+        custom_model_path = self._resolve_weights(custom_model_path)
         logger.info(f"Loading custom model: {custom_model_path}")
-        self.custom_model = YOLO(custom_model_path)
+        self.custom_model = YOLO(custom_model_path, task="detect")
         logger.info(f"Custom model loaded with {len(self.custom_model.names)} classes")
         
+        # Plain lists for O(1) indexed class lookups in postprocessing (model.names is a dict)
+        self._coco_names = [self.coco_model.names[i] for i in range(len(self.coco_model.names))]
+        self._custom_names = [self.custom_model.names[i] for i in range(len(self.custom_model.names))]
+        
+        # Restrict the COCO model to the classes the VR app consumes, so NMS skips the rest
+        self.wanted_ids = None
+        if coco_classes:
+            unknown = [name for name in coco_classes if name not in self._coco_names]
+            if unknown:
+                raise ValueError(f"Unknown COCO classes: {', '.join(unknown)}")
+            self.wanted_ids = sorted({self._coco_names.index(name) for name in coco_classes})
+            logger.info(f"COCO model limited to classes: {', '.join(coco_classes)}")
+        
+        # With PyTorch weights, call both networks directly on the shared tensor and run NMS
+        # ourselves, skipping the Ultralytics predictor's per-call setup and result objects
+        self._direct = all(
+            isinstance(model.model, torch.nn.Module) for model in (self.coco_model, self.custom_model)
+        )
+        # FP16 weights on CUDA, as Ultralytics' half=True does: roughly halves memory and
+        # doubles throughput on tensor-core GPUs (exported engines carry their own precision)
+        self._half = self._direct and self._device == "cuda"
+        if self._direct:
+            for model in (self.coco_model, self.custom_model):
+                model.model = model.model.fuse(verbose=False).to(self._device).eval()
+                if self._half:
+                    model.model.half()
+        if self._device == "cuda":
+            # Input shapes are fixed by the letterbox, so cuDNN's autotuned kernels get reused
+            torch.backends.cudnn.benchmark = True
+        
+        # On CUDA, run both forward passes on their own streams so the two small
+        # models' kernels overlap instead of serializing on the default stream
+        self.stream_coco = None
+        self.stream_custom = None
+        if self._direct and self._device == "cuda":
+            self.stream_coco = torch.cuda.Stream()
+            self.stream_custom = torch.cuda.Stream()
+            logger.info("Running COCO and custom models on parallel CUDA streams")
+        
+        # Optional CUDA graphs replay the fixed-shape batch-1 forward passes without per-kernel launch overhead
+        self.graph_coco = None
+        self.graph_custom = None
+        if cuda_graphs:
+            if self.stream_coco is None:
+                logger.warning("CUDA graphs need PyTorch weights on a CUDA device; disabled")
+            else:
+                self._capture_graphs()
+        
         logger.info(f"Dual detector ready with confidence threshold: {confidence}")
     
-    def decode_base64_image(self, base64_string: str) -> Image.Image:
-        """Decode base64 string to PIL Image"""
-        image_data = base64.b64decode(base64_string)
-        image = Image.open(BytesIO(image_data))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        logger.info(f"Decoded image: {image.width}x{image.height}, mode: {image.mode}")
-        return image
+    def warmup(self, batch_sizes: Sequence[int] = (1,)):
+        """Run both models on blank frames at each batch size so autotuning happens before the first request"""
+        dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        for batch_size in batch_sizes:
+            self.detect_batch([dummy] * batch_size)
+        logger.info(f"Dual detector warmed up for batch sizes {list(batch_sizes)}")
     
-    def detect_objects(self, image: Image.Image) -> List[Dict[str, Any]]:
-        """Run both models and merge detections"""
-        detections = []
-        
-        # Run COCO model
-        coco_results = self.coco_model(image, conf=self.confidence, verbose=False)
-        for result in coco_results:
-            boxes = result.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                conf = float(box.conf[0])
-                cls = int(box.cls[0])
-                class_name = self.coco_model.names[cls]
-                
-                detections.append({
-                    "class": class_name,
-                    "confidence": conf,
-                    "x1": int(x1),
-                    "y1": int(y1),
-                    "x2": int(x2),
-                    "y2": int(y2)
-                })
-        
-        # Run custom model
-        custom_results = self.custom_model(image, conf=self.confidence, verbose=False)
-        for result in custom_results:
-            boxes = result.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                conf = float(box.conf[0])
-                cls = int(box.cls[0])
-                class_name = self.custom_model.names[cls]
-                
-                detections.append({
-                    "class": class_name,
-                    "confidence": conf,
-                    "x1": int(x1),
-                    "y1": int(y1),
-                    "x2": int(x2),
-                    "y2": int(y2)
-                })
+    def _resolve_weights(self, model_path: str) -> str:
+        """
+        Prefer a model exported next to .pt weights (see train.py --export): a TensorRT
+        engine on CUDA (INT8 first) or an OpenVINO model on CPU; otherwise use the weights as given
+        """
+        if not model_path.endswith(".pt"):
+            return model_path
+        
+        weights = Path(model_path)
+        if self._device == "cuda":
+            candidates = (weights.with_name(f"{weights.stem}_int8.engine"), weights.with_suffix(".engine"))
+        else:
+            candidates = (weights.with_name(f"{weights.stem}_openvino_model"),)
+        for exported_path in candidates:
+            if exported_path.exists():
+                return str(exported_path)
+        return model_path
+    
+    def decode_base64_image(self, base64_string: str) -> Tuple[np.ndarray, int, int]:
+        """Decode base64 string to an RGB HWC uint8 array, returning (image, width, height)"""
+        if len(base64_string) // 4 * 3 > MAX_IMAGE_BYTES:
+            raise ValueError(f"image too large (limit: {MAX_IMAGE_BYTES // (1024 * 1024)} MB)")
+        image_data = pybase64.b64decode(base64_string, validate=False)
+        return self.decode_image_bytes(image_data)
+    
+    def decode_image_bytes(self, image_data: bytes) -> Tuple[np.ndarray, int, int]:
+        """Decode raw JPG/PNG bytes to an RGB HWC uint8 array, returning (image, width, height)"""
+        if len(image_data) > MAX_IMAGE_BYTES:
+            raise ValueError(f"image too large (limit: {MAX_IMAGE_BYTES // (1024 * 1024)} MB)")
+        
+        try:
+            # The letterboxed tensor is fed to the models as RGB
+            image = decode_jpeg(image_data)
+            if image is None:
+                pil_image = Image.open(BytesIO(image_data))
+                if pil_image.mode != 'RGB':
+                    pil_image = pil_image.convert('RGB')
+                image = np.asarray(pil_image)
+        except Exception as e:
+            logger.error(f"Error decoding image: {e}")
+            raise ValueError(f"Failed to decode image: {e}")
+        
+        height, width = image.shape[:2]
+        logger.info(f"Decoded image: {width}x{height}")
+        return image, width, height
+    
+    def _preprocess(self, images: List[np.ndarray]) -> torch.Tensor:
+        """Letterbox RGB images into one normalized (N, 3, imgsz, imgsz) tensor on the device"""
+        if self._device != "cuda":
+            letterboxed = np.stack([self._letterbox(image=image) for image in images])
+            tensor = torch.from_numpy(np.ascontiguousarray(letterboxed.transpose(0, 3, 1, 2)))
+            return tensor.float().div_(255)
+        
+        batch_size = len(images)
+        if self._host_buf is None or self._host_buf.shape[0] < batch_size:
+            shape = (batch_size, 3, self.imgsz, self.imgsz)
+            self._host_buf = torch.empty(shape, dtype=torch.uint8, pin_memory=True)
+            self._dev_buf = torch.empty(shape, dtype=torch.uint8, device=self._device)
         
+        # Letterbox straight into the pinned buffer (the previous batch's copy has already
+        # completed, since detect_batch synchronizes before returning)
+        host = self._host_buf.numpy()
+        for i, image in enumerate(images):
+            host[i] = self._letterbox(image=image).transpose(2, 0, 1)
+        
+        device_batch = self._dev_buf[:batch_size]
+        device_batch.copy_(self._host_buf[:batch_size], non_blocking=True)
+        return (device_batch.half() if self._half else device_batch.float()).div_(255)
+    
+    def _capture_graphs(self):
+        """Capture each model's batch-1 forward pass on a static imgsz x imgsz input as a CUDA graph"""
+        models = (self.coco_model, self.custom_model)
+        with torch.inference_mode():
+            dtype = torch.float16 if self._half else torch.float32
+            self.static_in = torch.zeros((1, 3, self.imgsz, self.imgsz), dtype=dtype, device=self._device)
+            
+            # Capture needs a few eager iterations on a side stream first (cuDNN/allocator warmup)
+            side = torch.cuda.Stream()
+            side.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(side):
+                for _ in range(3):
+                    for model in models:
+                        model.model(self.static_in)
+            torch.cuda.current_stream().wait_stream(side)
+            
+            self.graph_coco = torch.cuda.CUDAGraph()
+            self.graph_custom = torch.cuda.CUDAGraph()
+            self._static_out = []
+            for model, graph in zip(models, (self.graph_coco, self.graph_custom)):
+                with torch.cuda.graph(graph):
+                    preds = model.model(self.static_in)
+                self._static_out.append(preds[0] if isinstance(preds, (list, tuple)) else preds)
+        
+        logger.info(f"Captured CUDA graphs for batch-1 {self.imgsz}x{self.imgsz} inference")
+    
+    def _forward(self, tensor: torch.Tensor) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        """Run both networks on the preprocessed batch (on separate CUDA streams when available), then NMS each"""
+        if self.stream_coco is None:
+            with torch.inference_mode():
+                outputs = []
+                for model in (self.coco_model, self.custom_model):
+                    preds = model.model(tensor)
+                    outputs.append(preds[0] if isinstance(preds, (list, tuple)) else preds)
+            return self._nms(outputs)
+        
+        current = torch.cuda.current_stream()
+        # Graphs are captured for one input shape; other batch sizes run eagerly
+        graphs = (self.graph_coco, self.graph_custom) if self.graph_coco is not None and tensor.shape[0] == 1 else None
+        outputs = []
+        with torch.inference_mode():
+            if graphs:
+                self.static_in.copy_(tensor)
+            for i, (model, stream) in enumerate(
+                ((self.coco_model, self.stream_coco), (self.custom_model, self.stream_custom))
+            ):
+                # The input was produced on the current stream; don't read it before it is ready
+                stream.wait_stream(current)
+                with torch.cuda.stream(stream):
+                    if graphs:
+                        graphs[i].replay()
+                        preds = self._static_out[i]
+                    else:
+                        preds = model.model(tensor)
+                outputs.append(preds[0] if isinstance(preds, (list, tuple)) else preds)
+        
+        # Nothing may sync to the host before both models have been queued
+        torch.cuda.synchronize()
+        
+        return self._nms(outputs)
+    
+    def _nms(self, outputs: List[torch.Tensor]) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        """Apply the predictor's default NMS to each model's raw output (COCO limited to wanted_ids)"""
+        return tuple(
+            ops.non_max_suppression(preds, conf_thres=self.confidence, iou_thres=0.7, classes=classes, max_det=300)
+            for preds, classes in zip(outputs, (self.wanted_ids, None))
+        )
+    
+    def _to_detections(self, det: torch.Tensor, names: List[str], input_shape, orig_shape) -> List[Dict[str, Any]]:
+        """Convert one image's (n, 6) [x1, y1, x2, y2, conf, cls] detections into API detections"""
+        # Boxes come back in letterboxed coordinates; map them onto the original image
+        # (in FP32: FP16 can't represent every pixel coordinate of a large screenshot)
+        xyxy = ops.scale_boxes(input_shape, det[:, :4].to(torch.float32, copy=True), orig_shape)
+        
+        # One host transfer per model instead of a sync per box
+        xyxy = xyxy.cpu().numpy().astype(np.int32).tolist()
+        confidences = det[:, 4].cpu().numpy().astype(np.float64).tolist()
+        class_ids = det[:, 5].cpu().numpy().astype(np.int32).tolist()
+        
+        return [
+            {
+                "class": names[class_id],
+                "confidence": confidence,
+                "x1": x1,
+                "y1": y1,
+                "x2": x2,
+                "y2": y2
+            }
+            for (x1, y1, x2, y2), confidence, class_id in zip(xyxy, confidences, class_ids)
+        ]
+    
+    def detect_batch(self, images: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        """Run both models once over a batch of images; returns merged detections per image"""
+        try:
+            tensor = self._preprocess(images)
+            input_shape = tensor.shape[2:]
+            
+            if self._direct:
+                coco_dets, custom_dets = self._forward(tensor)
+            else:
+                # Each model sees the whole batch (Ultralytics skips its own preprocessing for tensors)
+                # imgsz must match the exported profile, or the predictor warms up at its 640 default
+                coco_results = self.coco_model.predict(
+                    source=tensor, conf=self.confidence, imgsz=self.imgsz, classes=self.wanted_ids, verbose=False
+                )
+                custom_results = self.custom_model.predict(
+                    source=tensor, conf=self.confidence, imgsz=self.imgsz, verbose=False
+                )
+                coco_dets = [result.boxes.data for result in coco_results]
+                custom_dets = [result.boxes.data for result in custom_results]
+            
+            batch_detections = []
+            for image, coco_det, custom_det in zip(images, coco_dets, custom_dets):
+                orig_shape = image.shape[:2]
+                detections = self._to_detections(coco_det, self._coco_names, input_shape, orig_shape)
+                detections.extend(
+                    self._to_detections(custom_det, self._custom_names, input_shape, orig_shape)
+                )
+                batch_detections.append(detections)
+            
+            return batch_detections
+        
+        except Exception as e:
+            logger.error(f"Error during dual YOLO detection: {e}")
+            raise RuntimeError(f"Detection failed: {e}")
+    
+    def detect_objects(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        """Run both models on a shared preprocessed tensor and merge detections"""
+        detections = self.detect_batch([image])[0]
         logger.info(f"Detected {len(detections)} objects (COCO + custom)")
         return detections
     
     def process_base64_image(self, base64_string: str) -> Dict[str, Any]:
         """Process base64 image and return detections in API format"""
-        image = self.decode_base64_image(base64_string)
+        image, width, height = self.decode_base64_image(base64_string)
         detections = self.detect_objects(image)
         
         return {
             "detections": detections,
-            "image_width": image.width,
-            "image_height": image.height
+            "image_width": width,
+            "image_height": height
         }
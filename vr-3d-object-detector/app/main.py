@@ -1,7 +1,10 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from app.config import settings
 from app.models import DetectionRequest, DetectionResponse
 from app.detector import YOLODetector
 from app.dual_detector import DualYOLODetector
@@ -16,41 +19,92 @@ logger = logging.getLogger(__name__)
 # Global detector instance
 detector = None
 
+# Micro-batching queue drained by batch_worker() (see settings.batch_window_ms / max_batch)
+detect_queue = None
+batch_task = None
+
+
+async def batch_worker():
+    """Drain queued (image, future) pairs into batched detector calls"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await detect_queue.get()]
+        deadline = loop.time() + settings.batch_window_ms / 1000
+        while len(batch) < settings.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(detect_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        # Skip requests that already timed out
+        batch = [(image, future) for image, future in batch if not future.done()]
+        if not batch:
+            continue
+        
+        try:
+            results = await asyncio.to_thread(detector.detect_batch, [image for image, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        
+        for (_, future), detections in zip(batch, results):
+            if not future.done():
+                future.set_result(detections)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup/shutdown events"""
-    global detector
+    global detector, detect_queue, batch_task
     
     # Startup: Initialize YOLO model
     logger.info("🚀 Starting VR Object Detector API...")
     
-    # Support custom model via environment variable
-    import os
-    model_path = os.getenv("MODEL_PATH", "yolov8n.pt")
-    custom_model_path = os.getenv("CUSTOM_MODEL_PATH", None)
-    confidence = float(os.getenv("CONFIDENCE_THRESHOLD", "0.4"))
-    
     # Use dual detector if custom model is specified
-    if custom_model_path:
+    if settings.custom_model_path:
         logger.info(f"🔄 Using DUAL detector mode")
-        logger.info(f"COCO Model: {model_path}, Custom Model: {custom_model_path}")
+        logger.info(f"COCO Model: {settings.model_path}, Custom Model: {settings.custom_model_path}")
         detector = DualYOLODetector(
-            coco_model_path=model_path,
-            custom_model_path=custom_model_path,
-            confidence=confidence
+            coco_model_path=settings.model_path,
+            custom_model_path=settings.custom_model_path,
+            confidence=settings.confidence_threshold,
+            imgsz=settings.imgsz,
+            cuda_graphs=settings.cuda_graphs,
+            coco_classes=settings.coco_classes
         )
         logger.info("✅ Dual YOLO models loaded and ready!")
     else:
         logger.info(f"📦 Using SINGLE detector mode")
-        logger.info(f"Model: {model_path}, Confidence: {confidence}")
-        detector = YOLODetector(model_name=model_path, confidence_threshold=confidence)
+        logger.info(f"Model: {settings.model_path}, Confidence: {settings.confidence_threshold}")
+        detector = YOLODetector(
+            model_name=settings.model_path,
+            confidence_threshold=settings.confidence_threshold,
+            export=settings.yolo_export,
+            export_dir=settings.export_dir,
+            max_batch=settings.max_batch,
+            imgsz=settings.imgsz
+        )
         logger.info("✅ YOLO model loaded and ready!")
     
+    try:
+        detector.warmup(settings.warmup_batch_sizes)
+    except Exception as e:
+        logger.warning(f"⚠️ Warmup failed, first requests may be slow: {e}")
+    
+    detect_queue = asyncio.Queue()
+    batch_task = asyncio.create_task(batch_worker())
+    logger.info(f"Micro-batching up to {settings.max_batch} images per {settings.batch_window_ms}ms window")
+    
     yield
     
     # Shutdown
     logger.info("🛑 Shutting down VR Object Detector API...")
+    batch_task.cancel()
 
 
 # Create FastAPI app
@@ -58,7 +112,9 @@ app = FastAPI(
     title="VR 3D Object Detector API",
     description="YOLO-based object detection API for Unity VR screenshots",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson encodes the detection lists much faster than the stdlib json encoder
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware (allow Unity to call from anywhere)
@@ -77,11 +133,12 @@ async def root():
     return {
         "service": "VR 3D Object Detector API",
         "status": "running",
-        "model": "yolov8n.pt",
-        "confidence_threshold": 0.4,
+        "model": settings.model_path,
+        "confidence_threshold": settings.confidence_threshold,
         "endpoints": {
             "health": "/health",
-            "detect": "/detect (POST)"
+            "detect": "/detect (POST)",
+            "detect_raw": "/detect_raw (POST, raw image bytes)"
         }
     }
 
@@ -98,20 +155,21 @@ async def health_check():
     return {
         "status": "healthy",
         "model_loaded": True,
-        "model": "yolov8n.pt"
+        "model": settings.model_path
     }
 
 
-@app.post("/detect", response_model=DetectionResponse, tags=["Detection"])
-async def detect_objects(request: DetectionRequest):
+async def run_detection(payload, raw: bool = False) -> dict:
     """
-    Detect objects in a base64-encoded image from Unity VR
+    Decode a request payload off the event loop, queue it for the next batch and
+    build the API response, mapping detector errors to HTTP status codes
     
     Args:
-        request: DetectionRequest with image_base64 field
+        payload: Base64 string, or raw image bytes when raw is True
+        raw: Whether payload holds the encoded image file itself
         
     Returns:
-        DetectionResponse with detections, image_width, image_height
+        Dictionary with detections, image_width, image_height
     """
     if detector is None:
         logger.error("Detector not initialized")
@@ -120,15 +178,22 @@ async def detect_objects(request: DetectionRequest):
             detail="YOLO detector not initialized"
         )
     
+    decode = detector.decode_image_bytes if raw else detector.decode_base64_image
+    
     try:
-        logger.info("📸 Received detection request from Unity")
+        # Decode off the event loop, then queue the image for the next batch
+        image, width, height = await asyncio.to_thread(decode, payload)
+        future = asyncio.get_running_loop().create_future()
+        detect_queue.put_nowait((image, future))
+        detections = await asyncio.wait_for(future, timeout=settings.detect_timeout)
         
-        # Process image and detect objects
-        result = detector.process_base64_image(request.image_base64)
+        logger.info(f"✅ Detection complete: {len(detections)} objects found")
         
-        logger.info(f"✅ Detection complete: {len(result['detections'])} objects found")
-        
-        return result
+        return {
+            "detections": detections,
+            "image_width": width,
+            "image_height": height
+        }
     
     except ValueError as e:
         logger.error(f"Invalid input: {e}")
@@ -144,9 +209,48 @@ async def detect_objects(request: DetectionRequest):
             detail=f"Detection failed: {str(e)}"
         )
     
+    except asyncio.TimeoutError:
+        logger.error(f"Detection timed out after {settings.detect_timeout}s")
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Detection timed out"
+        )
+    
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Unexpected error: {str(e)}"
         )
+
+
+@app.post("/detect", response_model=DetectionResponse, tags=["Detection"])
+async def detect_objects(request: DetectionRequest):
+    """
+    Detect objects in a base64-encoded image from Unity VR
+    
+    Args:
+        request: DetectionRequest with image_base64 field
+        
+    Returns:
+        DetectionResponse with detections, image_width, image_height
+    """
+    logger.info("📸 Received detection request from Unity")
+    return await run_detection(request.image_base64)
+
+
+@app.post("/detect_raw", response_model=DetectionResponse, tags=["Detection"])
+async def detect_objects_raw(request: Request):
+    """
+    Detect objects in a raw JPG/PNG body (Content-Type: application/octet-stream)
+    from Unity VR, skipping the base64 encode/decode round trip
+    
+    Args:
+        request: Request whose body is the encoded image file
+        
+    Returns:
+        DetectionResponse with detections, image_width, image_height
+    """
+    logger.info("📸 Received raw detection request from Unity")
+    body = await request.body()
+    return await run_detection(body, raw=True)
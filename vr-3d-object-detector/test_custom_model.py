@@ -3,6 +3,7 @@ Test custom model detection on training images
 """
 from ultralytics import YOLO
 from PIL import Image
+import numpy as np
 import sys
 
 # Load the custom model
@@ -29,19 +30,18 @@ for conf in [0.1, 0.25, 0.4, 0.6]:
     
     for result in results:
         boxes = result.boxes
-        for box in boxes:
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            confidence = float(box.conf[0])
-            cls = int(box.cls[0])
-            class_name = model.names[cls]
-            detections.append({
-                "class": class_name,
-                "confidence": confidence
-            })
+        # One host copy and int cast for all boxes, matching the API's integer coordinates
+        xyxy = boxes.xyxy.cpu().numpy().astype(np.int32).tolist()
+        class_ids = boxes.cls.cpu().numpy().astype(np.int32).tolist()
+        confidences = boxes.conf.cpu().numpy().tolist()
+        detections.extend(
+            {"class": model.names[cls], "confidence": confidence, "x1": x1, "y1": y1, "x2": x2, "y2": y2}
+            for cls, confidence, (x1, y1, x2, y2) in zip(class_ids, confidences, xyxy)
+        )
     
     print(f"Confidence={conf}: {len(detections)} detections")
     for det in detections:
-        print(f"  - {det['class']}: {det['confidence']:.3f}")
+        print(f"  - {det['class']}: {det['confidence']:.3f} [{det['x1']}, {det['y1']}, {det['x2']}, {det['y2']}]")
     print()
 
 # Also test with very low confidence to see what the model "sees"
@@ -51,8 +51,7 @@ results = model(image, conf=0.01, verbose=False)
 for result in results:
     boxes = result.boxes
     print(f"Total raw detections: {len(boxes)}")
-    for box in boxes:
-        confidence = float(box.conf[0])
-        cls = int(box.cls[0])
-        class_name = model.names[cls]
-        print(f"  - {class_name}: {confidence:.4f}")
+    class_ids = boxes.cls.cpu().numpy().astype(np.int32).tolist()
+    confidences = boxes.conf.cpu().numpy().tolist()
+    for cls, confidence in zip(class_ids, confidences):
+        print(f"  - {model.names[cls]}: {confidence:.4f}")
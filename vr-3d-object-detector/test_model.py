@@ -4,6 +4,7 @@ Test script for evaluating trained YOLOv8 model on validation/test images.
 Usage:
     python test_model.py --model runs/train/vr-custom/weights/best.pt
     python test_model.py --model runs/train/vr-custom/weights/best.pt --image path/to/test_image.jpg
+    python test_model.py --model runs/train/vr-custom/weights/best.pt --data data.yaml --imgsz 416
 """
 
 import argparse
@@ -11,9 +12,10 @@ from pathlib import Path
 from ultralytics import YOLO
 from PIL import Image
 import json
+import numpy as np
 
 
-def test_model(model_path: str, data_yaml: str = None, image_path: str = None):
+def test_model(model_path: str, data_yaml: str = None, image_path: str = None, imgsz: int = 640):
     """
     Test trained YOLO model
     
@@ -21,6 +23,7 @@ def test_model(model_path: str, data_yaml: str = None, image_path: str = None):
         model_path: Path to trained model (.pt file)
         data_yaml: Path to data.yaml (for validation set testing)
         image_path: Path to single image for testing
+        imgsz: Inference image size (match the API's IMGSZ)
     """
     
     print("=" * 60)
@@ -41,7 +44,7 @@ def test_model(model_path: str, data_yaml: str = None, image_path: str = None):
     # Test on validation set
     if data_yaml:
         print(f"🔍 Running validation on dataset: {data_yaml}")
-        metrics = model.val(data=data_yaml)
+        metrics = model.val(data=data_yaml, imgsz=imgsz)
         print("\n📈 Validation Metrics:")
         print(f"   mAP50: {metrics.box.map50:.4f}")
         print(f"   mAP50-95: {metrics.box.map:.4f}")
@@ -54,7 +57,7 @@ def test_model(model_path: str, data_yaml: str = None, image_path: str = None):
         print(f"🖼️  Testing on image: {image_path}")
         
         # Run inference
-        results = model(image_path, conf=0.4)
+        results = model(image_path, conf=0.4, imgsz=imgsz)
         
         # Display detections
         print(f"\n🎯 Detections:")
@@ -63,11 +66,12 @@ def test_model(model_path: str, data_yaml: str = None, image_path: str = None):
             if len(boxes) == 0:
                 print("   No objects detected")
             else:
-                for box in boxes:
-                    cls = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    class_name = model.names[cls]
-                    print(f"   - {class_name}: {conf:.2f}")
+                # One host copy and int cast for all boxes, not per-box int() calls
+                xyxy = boxes.xyxy.cpu().numpy().astype(np.int32).tolist()
+                class_ids = boxes.cls.cpu().numpy().astype(np.int32).tolist()
+                confidences = boxes.conf.cpu().numpy().tolist()
+                for cls, conf, (x1, y1, x2, y2) in zip(class_ids, confidences, xyxy):
+                    print(f"   - {model.names[cls]}: {conf:.2f} [{x1}, {y1}, {x2}, {y2}]")
         
         # Save annotated image
         output_path = Path(image_path).stem + "_detected.jpg"
@@ -98,6 +102,13 @@ def main():
         help="Path to single image for testing",
     )
     
+    parser.add_argument(
+        "--imgsz",
+        type=int,
+        default=640,
+        help="Inference image size (default: 640, the API default)",
+    )
+    
     args = parser.parse_args()
     
     if not args.data and not args.image:
@@ -108,6 +119,7 @@ def main():
         model_path=args.model,
         data_yaml=args.data,
         image_path=args.image,
+        imgsz=args.imgsz,
     )
 
 
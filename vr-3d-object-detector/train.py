@@ -5,17 +5,161 @@ This script:
 1. Loads pre-trained YOLOv8 model (keeps COCO knowledge)
 2. Fine-tunes on your custom labeled dataset (adds new classes)
 3. Saves the trained model for deployment
+4. Optionally exports it to a TensorRT engine (GPU) or OpenVINO model (CPU) for serving
 
 Usage:
     python train.py --data ./Labeled-Images.v1-2025-12.yolov8/data.yaml --epochs 50
+    python train.py --data ./Labeled-Images.v1-2025-12.yolov8/data.yaml --merge-coco coco.yaml --name vr-merged
+    python train.py --data ./Labeled-Images.v1-2025-12.yolov8/data.yaml --export engine
+    python train.py --export-only yolov8n.pt --export engine
+    python train.py --export-only yolov8n.pt --export openvino
+    python train.py --export-only best.pt --export engine --int8 --data ./Labeled-Images.v1-2025-12.yolov8/data.yaml
 """
 
 import argparse
 import os
 from pathlib import Path
+from typing import Tuple
+import yaml
 from ultralytics import YOLO
 
 
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def _split_images(data_yaml: Path, cfg: dict, split: str):
+    """Resolve a data.yaml split entry (directory, .txt image list, or a list of those) to image files"""
+    entries = cfg.get(split) or []
+    if isinstance(entries, str):
+        entries = [entries]
+    
+    root = Path(cfg.get("path") or data_yaml.parent)
+    if not root.is_absolute():
+        root = data_yaml.parent / root
+    
+    images = []
+    for entry in entries:
+        candidates = [root / entry, data_yaml.parent / entry]
+        if entry.startswith("../"):
+            # Roboflow exports write "../train/images" for directories next to data.yaml
+            candidates.append(data_yaml.parent / entry[3:])
+        for candidate in candidates:
+            if candidate.is_dir():
+                images.extend(p for p in sorted(candidate.rglob("*")) if p.suffix.lower() in IMAGE_SUFFIXES)
+                break
+            if candidate.is_file() and candidate.suffix == ".txt":
+                # Image lists (e.g. COCO's train2017.txt) hold paths relative to the list's directory
+                for line in candidate.read_text().splitlines():
+                    line = line.strip()
+                    if line:
+                        path = Path(line)
+                        path = path if path.is_absolute() else candidate.parent / path
+                        if path.suffix.lower() in IMAGE_SUFFIXES:
+                            images.append(path)
+                break
+        else:
+            raise FileNotFoundError(f"{split} entry not found for {data_yaml}: {entry}")
+    return [image.resolve() for image in images]
+
+
+def _label_path(image: Path) -> Path:
+    """Label file for an image, as Ultralytics' img2label_paths derives it (last /images/ -> /labels/)"""
+    images_dir, labels_dir = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return Path(labels_dir.join(str(image).rsplit(images_dir, 1))).with_suffix(".txt")
+
+
+def _link_split(images, out_dir: Path, prefix: str, class_offset: int) -> Tuple[int, int]:
+    """
+    Symlink images into out_dir/images and copy labels into out_dir/labels, shifting class IDs
+    
+    Returns:
+        (images linked, images that had a label file)
+    """
+    (out_dir / "images").mkdir(parents=True, exist_ok=True)
+    (out_dir / "labels").mkdir(parents=True, exist_ok=True)
+    
+    labeled = 0
+    for image in images:
+        name = f"{prefix}_{image.stem}"
+        link = out_dir / "images" / f"{name}{image.suffix}"
+        if not link.exists():
+            link.symlink_to(image)
+        
+        lines = []
+        label = _label_path(image)
+        if label.exists():
+            labeled += 1
+            for line in label.read_text().splitlines():
+                parts = line.split()
+                if parts:
+                    parts[0] = str(int(parts[0]) + class_offset)
+                    lines.append(" ".join(parts))
+        (out_dir / "labels" / f"{name}.txt").write_text("\n".join(lines))
+    return len(images), labeled
+
+
+def build_merged_dataset(custom_yaml: str, coco_yaml: str, output_dir: str = "datasets/vr-merged") -> str:
+    """
+    Build a single dataset covering the custom classes and the 80 COCO classes, so one
+    model can replace the COCO + custom pair (one backbone pass instead of two).
+    
+    Custom classes keep IDs 0..N-1 and COCO classes are shifted to N..N+79. Images are
+    symlinked, labels are rewritten.
+    
+    Args:
+        custom_yaml: Custom data.yaml (e.g. the Roboflow export)
+        coco_yaml: data.yaml of a local COCO subset in YOLO format (e.g. coco128 or coco)
+        output_dir: Where the merged dataset and its data.yaml are written
+    
+    Returns:
+        Path to the merged data.yaml
+    """
+    custom_yaml, coco_yaml = Path(custom_yaml), Path(coco_yaml)
+    for path in (custom_yaml, coco_yaml):
+        if not path.exists():
+            raise FileNotFoundError(f"Data config not found: {path}")
+    
+    custom_cfg = yaml.safe_load(custom_yaml.read_text())
+    coco_cfg = yaml.safe_load(coco_yaml.read_text())
+    
+    def class_names(cfg):
+        names = cfg["names"]
+        # data.yaml allows both a list and an {id: name} mapping
+        return [names[i] for i in sorted(names)] if isinstance(names, dict) else list(names)
+    
+    custom_names = class_names(custom_cfg)
+    coco_names = class_names(coco_cfg)
+    names = custom_names + coco_names
+    
+    output = Path(output_dir)
+    print(f"🧩 Merging {custom_yaml} ({len(custom_names)} classes) + {coco_yaml} ({len(coco_names)} classes)")
+    
+    splits = {}
+    for split in ("train", "val"):
+        counts = []
+        for source_yaml, cfg, prefix, offset in (
+            (custom_yaml, custom_cfg, "custom", 0),
+            (coco_yaml, coco_cfg, "coco", len(custom_names)),
+        ):
+            count, labeled = _link_split(_split_images(source_yaml, cfg, split), output / split, prefix, offset)
+            # Unlabeled images would silently train as background for every class
+            if labeled == 0:
+                raise ValueError(f"No {split} labels found for {source_yaml} ({count} images)")
+            counts.append(count)
+        print(f"   - {split}: {counts[0]} custom + {counts[1]} COCO images")
+        splits[split] = f"{split}/images"
+    
+    merged_yaml = output / "data.yaml"
+    merged_yaml.write_text(yaml.safe_dump(
+        {"path": str(output.resolve()), **splits, "nc": len(names), "names": names},
+        sort_keys=False,
+    ))
+    print(f"✅ Merged dataset ({len(names)} classes): {merged_yaml}")
+    print()
+    
+    return str(merged_yaml)
+
+
 def train_model(
     data_yaml: str,
     model: str = "yolov8n.pt",
@@ -106,6 +250,86 @@ def train_model(
     return results
 
 
+def export_model(
+    weights: str,
+    export_format: str = "engine",
+    imgsz: int = 640,
+    batch: int = 16,
+    int8: bool = False,
+    data_yaml: str = None,
+    max_map_drop: float = 0.01,
+):
+    """
+    Export trained weights for deployment. The exported model is written next to
+    the weights (e.g. best.pt -> best.engine, best_int8.engine with int8, or
+    best_openvino_model/), where the API picks it up.
+    
+    Args:
+        weights: Path to the .pt weights to export
+        export_format: Export format ("engine" = TensorRT FP16, requires an NVIDIA GPU;
+            "openvino" = OpenVINO FP16 for CPU-only deployments)
+        imgsz: Input size baked into the engine (must match the API's imgsz)
+        batch: Largest batch the engine accepts (match the API's MAX_BATCH)
+        int8: Build an INT8 engine calibrated on the data_yaml images (VR screenshots),
+            kept only if its mAP50-95 is within max_map_drop of the FP weights
+        data_yaml: Dataset used for INT8 calibration and the mAP check
+        max_map_drop: Largest relative mAP50-95 regression accepted for INT8
+    
+    Returns:
+        Path to the exported model, or None if the INT8 engine was rejected
+    """
+    if not os.path.exists(weights) and os.path.dirname(weights):
+        raise FileNotFoundError(f"Weights not found: {weights}")
+    
+    export_args = {"half": True}
+    if int8:
+        if export_format != "engine":
+            raise ValueError("INT8 export is only supported for TensorRT engines")
+        if not data_yaml:
+            raise ValueError("INT8 export needs --data for calibration images")
+        # TensorRT INT8 calibration landed in ultralytics 8.2
+        import ultralytics
+        from ultralytics.utils.checks import check_version
+        check_version(ultralytics.__version__, ">=8.2.0", name="ultralytics (INT8 TensorRT export)", hard=True)
+        export_args = {"int8": True, "data": data_yaml}
+    
+    precision = "INT8" if int8 else "FP16"
+    print(f"📦 Exporting {weights} to {export_format} {precision} (imgsz={imgsz}, batch={batch})...")
+    exported = YOLO(weights).export(
+        format=export_format,
+        imgsz=imgsz,
+        # Dynamic batch dimension (1..batch) so micro-batches of any size fit
+        dynamic=True,
+        batch=batch,
+        **export_args,
+    )
+    
+    if int8:
+        # Keep the FP16 engine name free; the API prefers <name>_int8.engine
+        exported_path = Path(exported)
+        int8_path = exported_path.with_name(f"{exported_path.stem}_int8{exported_path.suffix}")
+        exported_path.replace(int8_path)
+        exported = str(int8_path)
+        
+        # Gate deployment on the accuracy regression versus the FP weights
+        print("🧪 Validating INT8 engine against the original weights...")
+        base_map = YOLO(weights).val(data=data_yaml, imgsz=imgsz, verbose=False).box.map
+        int8_map = YOLO(exported, task="detect").val(data=data_yaml, imgsz=imgsz, batch=1, verbose=False).box.map
+        drop = (base_map - int8_map) / base_map if base_map > 0 else 0.0
+        print(f"   - mAP50-95: {base_map:.4f} (original) vs {int8_map:.4f} (INT8), drop {drop:.2%}")
+        
+        if drop > max_map_drop:
+            int8_path.unlink()
+            print(f"❌ INT8 regression exceeds {max_map_drop:.0%}; removed {int8_path}")
+            print()
+            return None
+    
+    print(f"✅ Exported model: {exported}")
+    print()
+    
+    return exported
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Train YOLOv8 on custom VR object detection dataset"
@@ -114,7 +338,6 @@ def main():
     parser.add_argument(
         "--data",
         type=str,
-        required=True,
         help="Path to data.yaml file (e.g., ./Labeled-Images.v1-2025-12.yolov8/data.yaml)",
     )
     
@@ -137,7 +360,7 @@ def main():
         "--imgsz",
         type=int,
         default=640,
-        help="Training image size (default: 640)",
+        help="Training/export image size; match the API's IMGSZ (default: 640, try 416 for ~2x speed)",
     )
     
     parser.add_argument(
@@ -167,11 +390,57 @@ def main():
         help="Allow overwriting existing training run",
     )
     
+    parser.add_argument(
+        "--export",
+        type=str,
+        choices=["engine", "openvino"],
+        help="Export the best weights after training (engine = TensorRT FP16, openvino = CPU)",
+    )
+    
+    parser.add_argument(
+        "--export-only",
+        type=str,
+        metavar="WEIGHTS",
+        help="Skip training and export existing weights (e.g. yolov8n.pt)",
+    )
+    
+    parser.add_argument(
+        "--merge-coco",
+        type=str,
+        metavar="COCO_YAML",
+        help="Merge --data with a COCO data.yaml and train one model on all classes "
+             "(replaces the COCO + custom dual detector)",
+    )
+    
+    parser.add_argument(
+        "--int8",
+        action="store_true",
+        help="Export an INT8 engine calibrated on --data (kept only if mAP drops < 1%%)",
+    )
+    
     args = parser.parse_args()
     
+    if args.export_only:
+        export_model(
+            args.export_only,
+            args.export or "engine",
+            imgsz=args.imgsz,
+            batch=args.batch,
+            int8=args.int8,
+            data_yaml=args.data,
+        )
+        return
+    
+    if not args.data:
+        parser.error("--data is required unless --export-only is given")
+    
+    data_yaml = args.data
+    if args.merge_coco:
+        data_yaml = build_merged_dataset(args.data, args.merge_coco)
+    
     # Train model
     train_model(
-        data_yaml=args.data,
+        data_yaml=data_yaml,
         model=args.model,
         epochs=args.epochs,
         imgsz=args.imgsz,
@@ -180,6 +449,18 @@ def main():
         name=args.name,
         exist_ok=args.exist_ok,
     )
+    
+    if args.export:
+        best_model = Path(args.project) / args.name / "weights" / "best.pt"
+        export_model(
+            str(best_model),
+            args.export,
+            imgsz=args.imgsz,
+            batch=args.batch,
+            int8=args.int8,
+            # INT8 calibration and the mAP gate must cover every class the model was trained on
+            data_yaml=data_yaml,
+        )
 
 
 if __name__ == "__main__":
@@ -31,7 +31,7 @@ print("-" * 60)
 results = model.train(
     data="./Labeled-Images.v1-2025-12.yolov8/data.yaml",
     epochs=50,
-    imgsz=640,
+    imgsz=640,  # Serve at the same size (IMGSZ)
     batch=4,  # Small batch for CPU
     patience=10,
     save=True,